@@ -4,32 +4,48 @@ Gem Voice API - A streamlined API for interacting with Gemini AI voice services.
 This file consolidates all the key functionality in a single, simplified module.
 """
 import os
-import sys
 import json
-import time
-import base64
+import gzip
+import binascii
+import struct
 import asyncio
+import hashlib
+import functools
 import logging
 import concurrent.futures
-import traceback
+from collections import deque
+from queue import Empty, SimpleQueue
 from threading import Thread, Lock
-from typing import Dict, Any, Optional, List
+from types import MappingProxyType
+from typing import Mapping, Any, Optional, List
 
 # Flask imports
-from flask import Flask, jsonify, render_template_string, request
-from flask_cors import CORS
+from flask import Flask, Response, request
+from jinja2 import Template
 from flask_sock import Sock
 
-# Google Gemini imports
-from google import genai
+# Optional libuv-backed event loop
 try:
-    from google.genai import types
-    TYPES_AVAILABLE = True
+    import uvloop
+    UVLOOP_AVAILABLE = True
+except ImportError:
+    UVLOOP_AVAILABLE = False
+
+# Optional fast JSON parsing
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
 except ImportError:
-    TYPES_AVAILABLE = False
+    ORJSON_AVAILABLE = False
+
+# Optional SIMD-accelerated base64 codec
+try:
+    import pybase64
+    PYBASE64_AVAILABLE = True
+except ImportError:
+    PYBASE64_AVAILABLE = False
 
 # WebSocket handling
-import websockets
 from websockets.exceptions import ConnectionClosedOK, ConnectionClosedError
 
 # Configure logging
@@ -52,6 +68,25 @@ CHANNELS = 1  # Mono
 SEND_SAMPLE_RATE = 16000
 RECEIVE_SAMPLE_RATE = 24000
 CHUNK_SIZE = 1024
+OUT_QUEUE_MAXSIZE = 10  # ~200 ms of 20 ms input frames
+AUDIO_IN_QUEUE_MAXSIZE = 64  # response chunks buffered for playback
+MAX_AUDIO_BATCH_BYTES = 32768  # ~0.68 s of 24 kHz 16-bit mono response audio
+
+# JSON envelope for response audio, split around the base64 payload
+AUDIO_MESSAGE_PREFIX = '{"type":"audio","format":"audio/wav","data":"'
+AUDIO_MESSAGE_SUFFIX = '"}'
+
+# Clients connecting with ?format=binary get raw WAV binary frames instead,
+# announced once by this message
+AUDIO_STREAM_CONFIG_MESSAGE = (
+    f'{{"type":"audio-stream-config","format":"audio/wav",'
+    f'"sample_rate":{RECEIVE_SAMPLE_RATE},"channels":{CHANNELS}}}'
+)
+
+# Binary WebSocket frames start with a one-byte opcode
+PCM_FRAME_OPCODE = 0x01
+INPUT_BUFFER_POOL_SIZE = 16
+CLIENT_OUTBOX_LIMIT = 32  # queued messages before a slow client is dropped
 MODEL = "models/gemini-2.0-flash-live-001"
 
 # Connection settings
@@ -60,6 +95,13 @@ MAX_RETRIES = 3
 RETRY_DELAY = 1.0
 PORT = int(os.getenv("PORT", 5000))
 
+# CORS headers for preflight requests, built once
+CORS_PREFLIGHT_HEADERS = {
+    'Access-Control-Allow-Methods': 'POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type',
+    'Access-Control-Max-Age': '86400',
+}
+
 # Vercel compatibility check
 IN_VERCEL = 'VERCEL' in os.environ or 'AWS_LAMBDA_FUNCTION_NAME' in os.environ
 
@@ -239,9 +281,21 @@ HOME_PAGE_TEMPLATE = """
         <li><strong>Format:</strong> 16-bit PCM</li>
         <li><strong>Channels:</strong> 1 (Mono)</li>
         <li><strong>Sample Rate:</strong> 16000 Hz (sending), 24000 Hz (receiving)</li>
-        <li><strong>Encoding:</strong> Base64 for WebSocket transmission</li>
+        <li><strong>Encoding:</strong> Binary frames or Base64 JSON messages over the WebSocket (see below)</li>
     </ul>
 
+    <h3>Sending Audio</h3>
+    <p>Send each chunk as a binary WebSocket frame: a single <code>0x01</code> opcode byte followed by raw 16-bit PCM. This skips base64 and JSON entirely. Text frames of the form <code>{"type": "audio", "data": "&lt;base64 PCM&gt;"}</code> are still accepted.</p>
+
+    <h3>Receiving Audio</h3>
+    <p>By default each response arrives as a text message <code>{"type": "audio", "format": "audio/wav", "data": "&lt;base64 WAV&gt;"}</code>. Clients that connect to <code>/audio-stream?format=binary</code> instead receive each response as a binary frame containing a complete WAV file. The stream is announced once on connect:</p>
+    <pre>{
+    "type": "audio-stream-config",
+    "format": "audio/wav",
+    "sample_rate": 24000,
+    "channels": 1
+}</pre>
+
     <h2>Code Examples</h2>
     
     <div class="tabs">
@@ -400,113 +454,171 @@ curl -X POST https://swatantra-ai.onrender.com/terminate_voice</pre>
 </html>
 """
 
+# Compile the home page once; autoescape matches render_template_string
+COMPILED_HOME_PAGE = Template(HOME_PAGE_TEMPLATE, autoescape=True)
+
 
 # ==== Helper Functions ====
 
+# Event loop factory for the audio loops: uvloop when installed
+new_event_loop = uvloop.new_event_loop if UVLOOP_AVAILABLE else asyncio.new_event_loop
+
+# JSON and base64 codecs, resolved once at import
+loads_json = orjson.loads if ORJSON_AVAILABLE else json.loads
+# The stdlib fallbacks call binascii directly, skipping base64's wrapper frames
+b64decode = pybase64.b64decode if PYBASE64_AVAILABLE else binascii.a2b_base64
+b64encode = pybase64.b64encode if PYBASE64_AVAILABLE else functools.partial(binascii.b2a_base64, newline=False)
+
+if ORJSON_AVAILABLE:
+    dumps_json = orjson.dumps
+else:
+    def dumps_json(obj):
+        """Serialize obj to compact JSON bytes."""
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+# Shared pool for blocking calls made from the audio loop
+THREAD_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="audio-io")
+
 async def run_in_thread(func, *args, **kwargs):
-    """Run a function in a separate thread and await its result."""
-    loop = asyncio.get_event_loop()
-    with concurrent.futures.ThreadPoolExecutor() as pool:
-        return await loop.run_in_executor(pool, lambda: func(*args, **kwargs))
+    """Run a function on the shared thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(THREAD_POOL, functools.partial(func, *args, **kwargs))
+
+# Little-endian uint32 used to patch WAV length fields in place
+UINT32_LE = struct.Struct('<I')
+WAV_HEADER_SIZE = 44
+
+# RIFF/WAVE header with a single PCM fmt chunk followed by the data chunk header
+WAV_HEADER = struct.Struct('<4sI4s4sIHHIIHH4sI')
 
 def create_wav_header(data_length, sample_rate=24000, channels=1, sample_width=2):
     """Create a WAV header for raw audio data."""
-    # RIFF header
-    header = bytearray()
-    header.extend(b'RIFF')
-    header.extend((data_length + 36).to_bytes(4, 'little'))  # 36 + data_length
-    header.extend(b'WAVE')
-    
-    # fmt chunk
-    header.extend(b'fmt ')
-    header.extend((16).to_bytes(4, 'little'))  # Chunk size: 16 for PCM
-    header.extend((1).to_bytes(2, 'little'))   # Audio format: 1 for PCM
-    header.extend(channels.to_bytes(2, 'little'))  # Channels
-    header.extend(sample_rate.to_bytes(4, 'little'))  # Sample rate
-    
-    # Byte rate: SampleRate * NumChannels * BitsPerSample/8
-    byte_rate = sample_rate * channels * sample_width
-    header.extend(byte_rate.to_bytes(4, 'little'))
-    
-    # Block align: NumChannels * BitsPerSample/8
     block_align = channels * sample_width
-    header.extend(block_align.to_bytes(2, 'little'))
+    return bytearray(WAV_HEADER.pack(
+        b'RIFF', data_length + 36, b'WAVE',
+        b'fmt ', 16, 1, channels, sample_rate,
+        sample_rate * block_align, block_align, sample_width * 8,
+        b'data', data_length,
+    ))
+
+class AudioBufferPool:
+    """
+    Free-list of bytearrays reused for inbound audio payloads.
     
-    # Bits per sample
-    bits_per_sample = sample_width * 8
-    header.extend(bits_per_sample.to_bytes(2, 'little'))
+    deque append/pop are atomic, so WebSocket threads can acquire while
+    the audio loop releases without an extra lock.
+    """
     
-    # Data chunk
-    header.extend(b'data')
-    header.extend(data_length.to_bytes(4, 'little'))
+    def __init__(self, count, size):
+        self._free = deque((bytearray(size) for _ in range(count)), maxlen=count)
+    
+    def acquire(self, payload):
+        """Copy payload into a pooled buffer, allocating one on a miss."""
+        try:
+            buf = self._free.pop()
+        except IndexError:
+            buf = bytearray()
+        buf[:] = payload
+        return buf
     
-    return header
+    def release(self, buf):
+        """Return a buffer to the pool once its contents have been sent."""
+        if isinstance(buf, bytearray):
+            self._free.append(buf)
+
+input_buffer_pool = AudioBufferPool(INPUT_BUFFER_POOL_SIZE, CHUNK_SIZE * 2)
+
+def get_base_url(environ):
+    """Build the public base URL straight from the WSGI environ."""
+    forwarded_host = environ.get('HTTP_X_FORWARDED_HOST')
+    if forwarded_host:
+        # For Vercel and other proxy setups
+        return f"{environ.get('HTTP_X_FORWARDED_PROTO', 'https')}://{forwarded_host}"
+    # For local development
+    return f"{environ['wsgi.url_scheme']}://{environ.get('HTTP_HOST') or environ['SERVER_NAME']}"
+
+def json_response(obj, status=200):
+    """Build a JSON response without going through Flask's json provider."""
+    return Response(dumps_json(obj), status=status, mimetype='application/json')
+
+# /status never changes at runtime, so health-check polls reuse one body
+STATUS_RESPONSE_BODY = dumps_json({
+    "status": "ok",
+    "vercel": IN_VERCEL,
+    "version": "1.0.0"
+})
+
+@functools.lru_cache(maxsize=8)
+def start_voice_response_body(ws_scheme, host):
+    """Serialize the /start_voice payload once per WebSocket scheme and host."""
+    return dumps_json({
+        "status": "started",
+        "websocket": {
+            "url": f"{ws_scheme}://{host}/audio-stream",
+            "protocol": "audio-stream"
+        }
+    })
+
+@functools.lru_cache(maxsize=8)
+def render_home_page(base_url):
+    """Render the home page once per base URL, with a gzipped copy and ETag."""
+    body = COMPILED_HOME_PAGE.render(base_url=base_url).encode('utf-8')
+    etag = hashlib.blake2b(body, digest_size=8).hexdigest()
+    return body, gzip.compress(body), etag
 
 
 # ==== Gemini Configuration ====
 
+# The Gemini SDK takes ~0.3 s to import, so it is imported on first use rather
+# than on every cold start; serverless deployments never open a session
+@functools.lru_cache(maxsize=1)
+def get_system_instruction_content():
+    """Build the voice-independent system prompt Content shared by every config."""
+    from google.genai import types
+    return types.Content(
+        parts=[types.Part.from_text(text=SYSTEM_INSTRUCTION)],
+        role="user"
+    )
+
+# Read-only generation and safety settings shared by every config
+GENERATION_CONFIG = MappingProxyType({
+    "temperature": 0.7,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 8192
+})
+SAFETY_SETTINGS = tuple(
+    MappingProxyType({"category": category, "threshold": "BLOCK_MEDIUM_AND_ABOVE"})
+    for category in (
+        "HARM_CATEGORY_HATE_SPEECH",
+        "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "HARM_CATEGORY_HARASSMENT",
+    )
+)
+
+@functools.lru_cache(maxsize=8)
 def get_live_connect_config(voice_name="Puck"):
-    """Create and return a configuration for Gemini API."""
-    # Check if we have the types module available
-    if TYPES_AVAILABLE:
-        # Use the types module to create LiveConnectConfig
-        live_connect_config = types.LiveConnectConfig(
-            response_modalities=["audio"],
-            speech_config=types.SpeechConfig(
-                voice_config=types.VoiceConfig(
-                    prebuilt_voice_config=types.PrebuiltVoiceConfig(voice_name=voice_name)
-                )
-            ),
-            system_instruction=types.Content(
-                parts=[types.Part.from_text(text=SYSTEM_INSTRUCTION)],
-                role="user"
-            ),
-        )
-    else:
-        # Fallback to dictionary structure if types not available
-        live_connect_config = {
-            "response_modalities": ["audio"],
-            "speech_config": {
-                "voice_config": {
-                    "prebuilt_voice_config": {"voice_name": voice_name}
-                }
-            },
-            "system_instruction": {
-                "parts": [{"text": SYSTEM_INSTRUCTION}],
-                "role": "user"
-            }
-        }
+    """Create and return a read-only configuration for Gemini API, shared per voice."""
+    from google.genai import types
+    live_connect_config = types.LiveConnectConfig(
+        response_modalities=["audio"],
+        speech_config=types.SpeechConfig(
+            voice_config=types.VoiceConfig(
+                prebuilt_voice_config=types.PrebuiltVoiceConfig(voice_name=voice_name)
+            )
+        ),
+        system_instruction=get_system_instruction_content(),
+    )
 
-    # Return a complete config compatible with our processor.py
-    return {
+    # Return a complete config compatible with our processor.py, read-only since it is shared
+    return MappingProxyType({
         "model": MODEL,
         "live_connect_config": live_connect_config,
-        "history": [],
-        "generation_config": {
-            "temperature": 0.7,
-            "top_p": 0.95,
-            "top_k": 40,
-            "max_output_tokens": 8192
-        },
-        "safety_settings": [
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS_CONTENT", 
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            }
-        ]
-    }
+        "history": (),
+        "generation_config": GENERATION_CONFIG,
+        "safety_settings": SAFETY_SETTINGS
+    })
 
 
 # ==== Audio Processing Class ====
@@ -524,18 +636,28 @@ class AudioLoop:
         self.client = client
         self.session = None
         self.is_running = False
-        self.audio_in_queue = asyncio.Queue()
-        self.out_queue = asyncio.Queue()
+        self.loop = None
+        self.audio_in_queue = asyncio.Queue(maxsize=AUDIO_IN_QUEUE_MAXSIZE)
+        self.out_queue = asyncio.Queue(maxsize=OUT_QUEUE_MAXSIZE)
+        self.dropped_input_frames = 0
+        self.dropped_response_chunks = 0
+        self._session_ctx = None
         self._processing_task = None
+        self._stop_event = None
         
-        # Check if we're running in a serverless environment
-        self.is_serverless = os.environ.get('VERCEL') == '1'
+        # Reusable WAV frame for response audio: a fixed header plus the payload
+        self._wav_frame = bytearray(create_wav_header(0, sample_rate=RECEIVE_SAMPLE_RATE))
 
-    async def connect_with_retry(self, config: Dict[str, Any], max_retries: int = 3) -> bool:
+    async def connect_with_retry(self, config: Mapping[str, Any], max_retries: int = 3) -> bool:
         """Attempt to connect to the Gemini API with retries."""
         retry_count = 0
         
         while retry_count < max_retries:
+            # Give up early if stop() was requested while connecting
+            if self._stop_event and self._stop_event.is_set():
+                logger.info("Stop requested, abandoning Gemini API connection")
+                return False
+            
             try:
                 logger.info(f"Connecting to Gemini API (attempt {retry_count + 1})")
                 
@@ -561,18 +683,32 @@ class AudioLoop:
         return False
     
     async def stop(self):
-        """Stop all audio processing and close connections."""
+        """Stop all audio processing and wait for run() to close connections."""
         logger.info("Stopping audio processing")
         self.is_running = False
         
-        # Give tasks time to notice the running flag change
-        await asyncio.sleep(0.5)
+        # Release run() so it winds down its tasks and closes the session
+        if self._stop_event:
+            self._stop_event.set()
         
-        if hasattr(self, '_session_ctx') and self._session_ctx and self.session:
+        # Wake consumers blocked on queue.get() with a None sentinel
+        for queue in (self.audio_in_queue, self.out_queue):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(None)
+        
+        run_task = self._processing_task
+        if run_task and run_task is not asyncio.current_task():
+            await asyncio.wait([run_task])
+        logger.info("Audio processing stopped completely")
+
+    async def _close_session(self):
+        """Close the Gemini session if one is open."""
+        if self._session_ctx and self.session:
             try:
                 logger.info("Closing Gemini API session")
-                # Use the context manager exit method to properly close the session
-                await self._session_ctx.__aexit__(None, None, None)
+                # Shield the close so a cancelled caller cannot abandon it half-done
+                await asyncio.shield(self._session_ctx.__aexit__(None, None, None))
                 logger.info("Gemini API session closed successfully")
             except Exception as e:
                 logger.error(f"Error closing session: {str(e)}")
@@ -580,18 +716,36 @@ class AudioLoop:
                 self.session = None
                 self._session_ctx = None
 
-        self._clear_queues()
-        logger.info("Audio processing stopped completely")
+    def enqueue_audio(self, content):
+        """Queue audio for Gemini from another thread without blocking it."""
+        if self.loop is None or self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self._put_audio, content)
+
+    def _put_audio(self, content):
+        """Put audio on the out_queue, dropping the oldest frame if it is full."""
+        if self.out_queue.full():
+            stale = self.out_queue.get_nowait()
+            input_buffer_pool.release(stale["data"])
+            self.dropped_input_frames += 1
+            if self.dropped_input_frames % 100 == 1:
+                logger.warning(f"Gemini falling behind, dropped {self.dropped_input_frames} input audio frames")
+        self.out_queue.put_nowait(content)
+
+    def _put_response_audio(self, data):
+        """Queue response audio, dropping the oldest chunk if playback lags."""
+        if self.audio_in_queue.full():
+            self.audio_in_queue.get_nowait()
+            self.dropped_response_chunks += 1
+            if self.dropped_response_chunks % 100 == 1:
+                logger.warning(f"Playback falling behind, dropped {self.dropped_response_chunks} response chunks")
+        self.audio_in_queue.put_nowait(data)
 
     def _clear_queues(self):
-        """Clear any pending items from queues."""
-        for queue in [self.audio_in_queue, self.out_queue]:
-            if queue:
-                while not queue.empty():
-                    try:
-                        queue.get_nowait()
-                    except:
-                        pass
+        """Drop any pending items by replacing both queues."""
+        # Consumers have exited on the stop() sentinel, so nothing holds the old queues
+        self.audio_in_queue = asyncio.Queue(maxsize=AUDIO_IN_QUEUE_MAXSIZE)
+        self.out_queue = asyncio.Queue(maxsize=OUT_QUEUE_MAXSIZE)
 
     async def send_realtime(self):
         """Send audio data from the out_queue to the Gemini API in real-time."""
@@ -599,19 +753,41 @@ class AudioLoop:
             if not self.session or not self.is_running:
                 raise ValueError("Session not initialized or not running")
             
-            while self.is_running:
-                if not self.out_queue.empty():
-                    content = await self.out_queue.get()
-                    
-                    if content:
-                        # Send the audio content to the Gemini API using the proper method
-                        await self.session.send(input=content)
+            pending = None
+            stopping = False
+            while self.is_running and not stopping:
+                content = pending if pending is not None else await self.out_queue.get()
+                pending = None
+                if content is None:
+                    break
                 
-                await asyncio.sleep(0.01)  # Small sleep to prevent CPU hogging
+                # Merge frames that queued up while the previous send was in flight;
+                # only bytes-like payloads of the same format can be joined
+                frames = [content["data"]]
+                while not isinstance(content["data"], str) and not self.out_queue.empty():
+                    following = self.out_queue.get_nowait()
+                    if following is None:
+                        stopping = True
+                        break
+                    if following["mime_type"] != content["mime_type"] or isinstance(following["data"], str):
+                        pending = following
+                        break
+                    frames.append(following["data"])
+                
+                if len(frames) > 1:
+                    content = {"data": b"".join(frames), "mime_type": content["mime_type"]}
+                    for frame in frames:
+                        input_buffer_pool.release(frame)
+                
+                # Send the audio content to the Gemini API using the proper method
+                await self.session.send(input=content)
+                # The SDK has serialized the payload, so its buffer can be reused
+                input_buffer_pool.release(content["data"])
                 
         except Exception as e:
             logger.error(f"Error in send_realtime: {str(e)}")
             self.is_running = False
+            self._stop_event.set()
 
     async def receive_audio(self):
         """Receive audio responses from the Gemini API and put them in the audio_in_queue."""
@@ -620,43 +796,43 @@ class AudioLoop:
                 raise ValueError("Session not initialized or not running")
             
             # Continuously receive responses while the loop is running
+            failures = 0
             while self.is_running:
                 try:
-                    # Use the turn-based approach
-                    turn = self.session.receive()
-                    async for response in turn:
+                    # Each receive() drives one turn to completion
+                    async for response in self.session.receive():
+                        failures = 0
                         if data := response.data:
-                            await self.audio_in_queue.put(data)
+                            self._put_response_audio(data)
                 except asyncio.CancelledError:
                     logger.info("Receive audio operation cancelled")
                     break
+                except (ConnectionClosedOK, ConnectionClosedError) as e:
+                    # A closed session cannot be resumed by receiving again
+                    logger.info(f"Gemini API connection closed: {str(e)}")
+                    self.is_running = False
+                    self._stop_event.set()
                 except Exception as e:
+                    failures += 1
+                    if failures > MAX_RETRIES:
+                        logger.error(f"Giving up on Gemini responses after {MAX_RETRIES} retries: {str(e)}")
+                        self.is_running = False
+                        self._stop_event.set()
+                        break
                     logger.error(f"Error receiving audio response: {str(e)}")
-                    if "timeout" in str(e).lower():
-                        await asyncio.sleep(1)  # Brief pause before retry
-                        continue
-                    break
-                
-                await asyncio.sleep(0.01)  # Small sleep to prevent CPU hogging
+                    await asyncio.sleep(min(RETRY_DELAY * 2 ** (failures - 1), 10.0))
                 
         except Exception as e:
             logger.error(f"Error in receive_audio: {str(e)}")
             self.is_running = False
+            self._stop_event.set()
 
     async def listen_audio(self):
         """Process audio input from WebSocket clients."""
-        # In serverless mode, we just keep the task alive
-        if self.is_serverless:
-            logger.info("Audio capture handled via WebSocket connections")
-            while self.is_running:
-                await asyncio.sleep(0.5)  # Keep the task alive
-            return
-            
         try:
-            # Keep the method running while the audio loop is active
-            while self.is_running:
-                # Audio data is passed to self.out_queue by the WebSocket handler
-                await asyncio.sleep(0.5)  # Just sleep to keep the task alive
+            # Audio data is passed to self.out_queue by the WebSocket handler,
+            # so this task only has to stay alive until stop() is requested
+            await self._stop_event.wait()
                 
         except asyncio.CancelledError:
             logger.info("Listen audio task cancelled")
@@ -671,96 +847,194 @@ class AudioLoop:
             # Get access to active WebSocket clients from the global variable
             global ws_clients
             
-            while self.is_running:
-                if not self.audio_in_queue.empty():
-                    audio_data = await self.audio_in_queue.get()
-                    
-                    if audio_data and ws_clients:
-                        try:
-                            # Add WAV header to the raw audio data
-                            sample_rate = RECEIVE_SAMPLE_RATE
-                            channels = 1  # Mono
-                            sample_width = 2  # 16-bit audio
-                            
-                            # Create WAV header
-                            wav_header = create_wav_header(
-                                len(audio_data), 
-                                sample_rate=sample_rate,
-                                channels=channels, 
-                                sample_width=sample_width
-                            )
-                            
-                            # Combine header with audio data
-                            wav_data = wav_header + audio_data
-                            
-                            # Send the audio data to all connected clients
-                            encoded_audio = base64.b64encode(wav_data).decode('utf-8');
-                            message = json.dumps({
-                                "type": "audio",
-                                "format": "audio/wav",
-                                "data": encoded_audio
-                            })
-                            
-                            # Send to all connected clients
-                            for ws in list(ws_clients):
-                                try:
-                                    ws.send(message)
-                                except Exception as e:
-                                    logger.error(f"Error sending audio to client: {str(e)}")
-                        
-                        except Exception as e:
-                            logger.error(f"Error preparing audio data: {str(e)}")
+            stopping = False
+            while self.is_running and not stopping:
+                audio_data = await self.audio_in_queue.get()
+                if audio_data is None:
+                    break
                 
-                await asyncio.sleep(0.01)  # Small sleep to prevent CPU hogging
+                # Coalesce chunks that are already queued into one message
+                chunks = [audio_data]
+                data_length = len(audio_data)
+                while data_length < MAX_AUDIO_BATCH_BYTES and not self.audio_in_queue.empty():
+                    chunk = self.audio_in_queue.get_nowait()
+                    if chunk is None:
+                        stopping = True
+                        break
+                    chunks.append(chunk)
+                    data_length += len(chunk)
+                
+                # Build payloads for, and deliver to, the same set of clients
+                clients = ws_clients.snapshot()
+                if clients:
+                    try:
+                        # Copy the payload into the session's frame buffer and patch
+                        # the RIFF and data chunk sizes; the encoder copies it out
+                        wav_data = self._wav_frame
+                        wav_data[WAV_HEADER_SIZE:] = audio_data if len(chunks) == 1 else b''.join(chunks)
+                        UINT32_LE.pack_into(wav_data, 4, data_length + 36)
+                        UINT32_LE.pack_into(wav_data, 40, data_length)
+                        
+                        # Base64 never needs JSON escaping, so fill in the fixed envelope
+                        message = frame = None
+                        if not all(binary for _, _, binary in clients):
+                            encoded_audio = b64encode(wav_data).decode('ascii')
+                            message = AUDIO_MESSAGE_PREFIX + encoded_audio + AUDIO_MESSAGE_SUFFIX
+                        if any(binary for _, _, binary in clients):
+                            # Writers send after the frame buffer is reused, so copy it out
+                            frame = bytes(wav_data)
+                        
+                        # Hand the message to each client's writer thread
+                        ws_clients.broadcast(clients, message, frame)
+                    
+                    except Exception as e:
+                        logger.error(f"Error preparing audio data: {str(e)}")
                 
         except Exception as e:
-            logger.error(f"Error in play_audio: {str(e)}")
-            logger.error(traceback.format_exc())
+            logger.exception(f"Error in play_audio: {str(e)}")
 
     async def run(self, config):
         """Start the main audio processing loop."""
         try:
+            self.loop = asyncio.get_running_loop()
+            self._processing_task = asyncio.current_task()
+            # Created before connecting so an early stop() is not lost
+            self._stop_event = asyncio.Event()
             await self.connect_with_retry(config)
             if not self.session:
+                if self._stop_event.is_set():
+                    return
                 raise Exception("Failed to establish session")
 
             # Create tasks
+            receive_task = asyncio.create_task(self.receive_audio())
             tasks = [
                 asyncio.create_task(self.send_realtime()),
                 asyncio.create_task(self.listen_audio()),
-                asyncio.create_task(self.receive_audio()),
+                receive_task,
                 asyncio.create_task(self.play_audio())
             ]
             
-            # Wait for all tasks to complete or cancel
-            self._stop_event = asyncio.Event()
+            # Wait until stop() is requested or a task gives up
             await self._stop_event.wait()
             
-            # Cancel all tasks when done
-            for task in tasks:
-                if not task.done():
-                    task.cancel()
+            # Nothing is left to flush from Gemini, but the other tasks exit on the
+            # queue sentinels; cancel any that outlast the grace period
+            receive_task.cancel()
+            _, pending = await asyncio.wait(tasks, timeout=0.5)
+            for task in pending:
+                task.cancel()
             
             await asyncio.gather(*tasks, return_exceptions=True)
 
         except Exception as e:
-            logger.error(f"Error in run: {str(e)}")
-            logger.error(traceback.format_exc())
+            logger.exception(f"Error in run: {str(e)}")
         finally:
             self.is_running = False
-            await self.stop()
+            await self._close_session()
+            self._clear_queues()
+
+
+# ==== WebSocket Client Registry ====
+
+class ClientRegistry:
+    """
+    Tracks connected WebSocket clients and their outbound queues.
+    
+    Membership is a copy-on-write tuple swapped under a lock, so the
+    audio loop broadcasts over a snapshot without locking, and each
+    client's writer thread does the blocking ws.send().
+    """
+    
+    def __init__(self):
+        self._lock = Lock()
+        self._clients = ()
+    
+    def __len__(self):
+        return len(self._clients)
+    
+    def add(self, ws, binary=False):
+        """Register a client and return its outbound queue."""
+        outbox = SimpleQueue()
+        with self._lock:
+            self._clients = self._clients + ((ws, outbox, binary),)
+        return outbox
+    
+    def remove(self, ws):
+        """Unregister a client if it is still registered."""
+        with self._lock:
+            remaining = tuple(c for c in self._clients if c[0] is not ws)
+            if len(remaining) != len(self._clients):
+                self._clients = remaining
+    
+    def snapshot(self):
+        """Return the current (ws, outbox, binary) entries."""
+        return self._clients
+    
+    def broadcast(self, clients, message, frame=None):
+        """Queue a message for each client in a snapshot, dropping any that fall too far behind."""
+        for ws, outbox, binary in clients:
+            if outbox.qsize() >= CLIENT_OUTBOX_LIMIT:
+                logger.warning("Dropping WebSocket client that fell behind on audio")
+                self.remove(ws)
+                # Discard the backlog so the writer closes instead of sending stale audio
+                try:
+                    while True:
+                        outbox.get_nowait()
+                except Empty:
+                    pass
+                outbox.put_nowait(None)
+                continue
+            payload = frame if binary else message
+            # None is the writer's close sentinel, never a payload
+            if payload is not None:
+                outbox.put_nowait(payload)
+    
+    def close_all(self):
+        """Unregister every client and tell its writer to close the socket."""
+        with self._lock:
+            clients, self._clients = self._clients, ()
+        for _, outbox, _ in clients:
+            outbox.put_nowait(None)
+
+def run_client_writer(ws, outbox):
+    """Send queued messages to one WebSocket client until told to close."""
+    while True:
+        message = outbox.get()
+        if message is None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+            return
+        
+        try:
+            ws.send(message)
+        except Exception as e:
+            # Prune the dead client so broadcasts stop queueing for it
+            logger.error(f"Error sending audio to client: {str(e)}")
+            ws_clients.remove(ws)
+            try:
+                ws.close()
+            except Exception:
+                pass
+            return
 
 
 # ==== Flask Application Setup ====
 
 # Global variables for managing state
 audio_loop = None
-audio_thread = None
+audio_future = None
+background_loop = None
+background_loop_lock = Lock()
 session_lock = Lock()
-ws_clients = set()
+ws_clients = ClientRegistry()
 
+@functools.lru_cache(maxsize=1)
 def create_gemini_client():
-    """Create and configure the Gemini API client."""
+    """Create and configure the Gemini API client, shared by every session."""
+    from google import genai
     return genai.Client(
         http_options={
             "api_version": "v1beta",
@@ -778,231 +1052,249 @@ def create_audio_loop():
     client = create_gemini_client()
     return AudioLoop(client)
 
-def run_async_task(coro_func, *args, **kwargs):
-    """Run an async function in a new event loop safely."""
+def get_background_loop():
+    """Return the shared event loop, starting its thread on first use."""
+    global background_loop
+    
+    with background_loop_lock:
+        if background_loop is None:
+            loop = new_event_loop()
+            Thread(target=loop.run_forever, name="audio-loop", daemon=True).start()
+            background_loop = loop
+    return background_loop
+
+def start_audio_loop(config):
+    """Create an AudioLoop and schedule it on the background event loop."""
+    new_loop = create_audio_loop()
+    if new_loop is None:
+        return None, None
+    
+    future = asyncio.run_coroutine_threadsafe(new_loop.run(config), get_background_loop())
+    return new_loop, future
+
+def stop_audio_loop(loop_to_stop, timeout=2.0):
+    """Stop an AudioLoop on the background event loop and wait for it."""
+    future = asyncio.run_coroutine_threadsafe(
+        loop_to_stop.stop(), get_background_loop()
+    )
+    
+    # stop() returns as soon as run() has finished tearing down
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        return loop.run_until_complete(coro_func(*args, **kwargs))
-    finally:
-        loop.close()
+        future.result(timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        logger.warning("Audio loop did not finish shutting down in time")
 
 def create_app():
     """Create and configure the Flask application."""
     app = Flask(__name__)
     
-    # Enable CORS
-    CORS(app, resources={r"/*": {"origins": "*", "supports_credentials": True}})
+    # Enable CORS: echo the caller's origin so credentialed requests work
+    @app.after_request
+    def add_cors_headers(response):
+        origin = request.environ.get('HTTP_ORIGIN')
+        if origin:
+            response.headers['Access-Control-Allow-Origin'] = origin
+            response.headers['Access-Control-Allow-Credentials'] = 'true'
+            response.vary.add('Origin')
+        return response
     
     # Initialize WebSocket support
     sock = Sock(app)
     
-    # Store the Gemini configuration in app config
-    app.config['GEMINI_CONFIG'] = get_live_connect_config()
-    
     # === Routes ===
     
     @app.route('/')
     def home():
         """Home page with API documentation."""
-        # Get the base URL from the request
-        if request.headers.get('X-Forwarded-Host'):
-            # For Vercel and other proxy setups
-            proto = request.headers.get('X-Forwarded-Proto', 'https')
-            host = request.headers.get('X-Forwarded-Host')
-            base_url = f"{proto}://{host}"
+        base_url = get_base_url(request.environ)
+        body, gzipped, etag = render_home_page(base_url)
+        
+        # Serve the gzipped variant under its own ETag
+        use_gzip = request.accept_encodings.quality('gzip') > 0
+        if use_gzip:
+            body, etag = gzipped, f"{etag}-gz"
+        
+        if etag in request.if_none_match:
+            response = Response(status=304)
         else:
-            # For local development
-            base_url = f"{request.scheme}://{request.host}"
-            
-        return render_template_string(
-            HOME_PAGE_TEMPLATE,
-            base_url=base_url
-        )
+            response = Response(body, mimetype='text/html')
+            if use_gzip:
+                response.headers['Content-Encoding'] = 'gzip'
+        response.set_etag(etag)
+        response.vary.add('Accept-Encoding')
+        return response
     
     @sock.route('/audio-stream')
     def audio_stream_socket(ws):
         """WebSocket handler for audio streaming."""
         global audio_loop
+        global audio_future
         global ws_clients
         
         logger.info("New WebSocket client connected for audio streaming")
         
-        # Add the WebSocket to our clients set
-        ws_clients.add(ws)
+        # Register the WebSocket and start its writer thread
+        binary = request.args.get("format") == "binary"
+        outbox = ws_clients.add(ws, binary=binary)
+        if binary:
+            outbox.put_nowait(AUDIO_STREAM_CONFIG_MESSAGE)
+        Thread(target=run_client_writer, args=(ws, outbox), daemon=True).start()
         
         try:
             # Check if we have an active audio loop
             if not audio_loop or not audio_loop.is_running:
                 logger.warning("Client connected but no active audio session. Starting one.")
                 
-                # Start an audio session if none exists
-                if not audio_loop:
-                    audio_loop = create_audio_loop()
-                    
-                    # Start the audio loop in a new thread
-                    global audio_thread
-                    audio_thread = Thread(
-                        target=lambda: run_async_task(audio_loop.run, app.config['GEMINI_CONFIG']),
-                        daemon=True
-                    )
-                    audio_thread.start()
+                # Start an audio session if none exists or its run task has ended;
+                # checked under the lock so simultaneous connects cannot each
+                # start their own session
+                with session_lock:
+                    if not audio_loop or audio_future is None or audio_future.done():
+                        ended_loop = audio_loop
+                        audio_loop, audio_future = start_audio_loop(get_live_connect_config())
+                        if ended_loop:
+                            stop_audio_loop(ended_loop)
             
             # Process WebSocket messages
             while True:
                 message = ws.receive()
                 
-                if message:
+                if message and isinstance(message, (bytes, bytearray)):
+                    # Binary frame: opcode byte followed by raw PCM, no base64
+                    if message[0] == PCM_FRAME_OPCODE:
+                        if audio_loop and audio_loop.is_running:
+                            audio_loop.enqueue_audio({
+                                "data": input_buffer_pool.acquire(memoryview(message)[1:]),
+                                "mime_type": "audio/pcm"
+                            })
+                    else:
+                        logger.debug(f"Ignoring binary frame with opcode {message[0]}")
+                
+                elif message:
                     try:
-                        # Try to parse as JSON
-                        data = json.loads(message)
+                        # Text frames carry JSON messages
+                        data = loads_json(message)
                         
                         if data.get("type") == "audio":
                             # Decode base64 audio data
-                            audio_bytes = base64.b64decode(data["data"])
+                            audio_bytes = b64decode(data["data"])
                             
                             if audio_loop and audio_loop.is_running:
-                                asyncio.run(audio_loop.out_queue.put({
+                                audio_loop.enqueue_audio({
                                     "data": audio_bytes,
                                     "mime_type": data.get("format", "audio/pcm")
-                                }))
+                                })
                         
                         elif data.get("type") == "control":
                             # Handle control messages
                             if data.get("command") == "stop":
                                 logger.info("Client requested audio session stop")
                                 if audio_loop:
-                                    asyncio.run(audio_loop.stop())
+                                    stop_audio_loop(audio_loop)
                     except json.JSONDecodeError:
                         # If not JSON, treat as raw audio data
                         if audio_loop and audio_loop.is_running:
-                            asyncio.run(audio_loop.out_queue.put({
+                            audio_loop.enqueue_audio({
                                 "data": message,
                                 "mime_type": "audio/pcm"
-                            }))
+                            })
         except Exception as e:
             logger.error(f"WebSocket error: {str(e)}")
         finally:
-            if ws in ws_clients:
-                ws_clients.remove(ws)
+            ws_clients.remove(ws)
+            outbox.put_nowait(None)
             logger.info("WebSocket client disconnected")
     
     @app.route('/start_voice', methods=['POST', 'OPTIONS'])
     def start_voice():
         """Start voice interaction with Gemini AI."""
         global audio_loop
-        global audio_thread
+        global audio_future
         
         # Handle CORS preflight request
         if request.method == 'OPTIONS':
-            response = app.make_default_options_response()
-            response.headers['Access-Control-Allow-Methods'] = 'POST'
-            return response
+            return '', 204, CORS_PREFLIGHT_HEADERS
             
         if IN_VERCEL:
-            return jsonify({
+            return json_response({
                 "status": "started",
                 "vercel": True,
                 "info": "Limited functionality in serverless environment."
             })
         
+        # Only the pointer swap happens under the lock; stopping runs outside it
         with session_lock:
-            # If there's an existing session, terminate it first
-            if audio_loop:
-                try:
-                    run_async_task(audio_loop.stop)
-                    logger.info("Existing voice session terminated before starting new one")
-                    
-                    # Wait for the thread to finish
-                    if audio_thread and audio_thread.is_alive():
-                        audio_thread.join(timeout=2.0)
-                        
-                except Exception as e:
-                    logger.error(f"Error terminating existing voice service: {str(e)}")
-                finally:
-                    # Force cleanup of resources
-                    audio_loop = None
-                    audio_thread = None
-                    # Small delay to ensure clean startup
-                    time.sleep(0.5)
-            
+            old_loop, audio_loop = audio_loop, None
+            audio_future = None
+        
+        # If there's an existing session, terminate it first
+        if old_loop:
             try:
-                # Create a new audio loop
-                audio_loop = create_audio_loop()
-                
-                # Start the audio loop in a new thread
-                audio_thread = Thread(
-                    target=lambda: run_async_task(audio_loop.run, app.config['GEMINI_CONFIG']),
-                    daemon=True
-                )
-                audio_thread.start()
-                
-                logger.info("Voice session started")
-                
-                # Return WebSocket info in the response
-                return jsonify({
-                    "status": "started",
-                    "websocket": {
-                        "url": f"wss://{request.host}/audio-stream" if request.is_secure else f"ws://{request.host}/audio-stream",
-                        "protocol": "audio-stream"
-                    }
-                })
+                stop_audio_loop(old_loop)
+                logger.info("Existing voice session terminated before starting new one")
             except Exception as e:
-                logger.error(f"Error starting voice service: {str(e)}")
-                return jsonify({"status": "error", "message": str(e)})
+                logger.error(f"Error terminating existing voice service: {str(e)}")
+        
+        try:
+            # Schedule a new audio loop on the background event loop
+            new_loop, new_future = start_audio_loop(get_live_connect_config())
+            with session_lock:
+                displaced_loop, audio_loop = audio_loop, new_loop
+                audio_future = new_future
+            
+            # A concurrent request may have installed a session meanwhile
+            if displaced_loop:
+                stop_audio_loop(displaced_loop)
+            
+            logger.info("Voice session started")
+            
+            # Return WebSocket info in the response
+            ws_scheme = "wss" if request.is_secure else "ws"
+            return Response(
+                start_voice_response_body(ws_scheme, request.host),
+                mimetype='application/json'
+            )
+        except Exception as e:
+            logger.error(f"Error starting voice service: {str(e)}")
+            return json_response({"status": "error", "message": str(e)})
 
     @app.route('/terminate_voice', methods=['POST', 'OPTIONS'])
     def terminate_voice():
         """Completely stop the voice interaction and clean up resources."""
         global audio_loop
-        global audio_thread
+        global audio_future
         global ws_clients
         
         # Handle CORS preflight request
         if request.method == 'OPTIONS':
-            response = app.make_default_options_response()
-            response.headers['Access-Control-Allow-Methods'] = 'POST'
-            return response
+            return '', 204, CORS_PREFLIGHT_HEADERS
             
         if IN_VERCEL:
-            return jsonify({"status": "terminated", "vercel": True})
+            return json_response({"status": "terminated", "vercel": True})
         
+        # Only the pointer swap happens under the lock; stopping runs outside it
         with session_lock:
-            if audio_loop:
-                try:
-                    # Stop the audio loop
-                    run_async_task(audio_loop.stop)
-                    logger.info("Voice session terminated")
+            old_loop, audio_loop = audio_loop, None
+            audio_future = None
+        
+        if old_loop:
+            try:
+                # Stop the audio loop
+                stop_audio_loop(old_loop)
+                logger.info("Voice session terminated")
+                
+                # Close any active WebSocket connections
+                ws_clients.close_all()
                     
-                    # Wait for the thread to finish
-                    if audio_thread and audio_thread.is_alive():
-                        audio_thread.join(timeout=2.0)
-                        
-                    # Close any active WebSocket connections
-                    for ws in list(ws_clients):
-                        try:
-                            ws.close()
-                        except:
-                            pass
-                    ws_clients.clear()
-                        
-                except Exception as e:
-                    logger.error(f"Error terminating voice service: {str(e)}")
-                finally:
-                    # Clean up resources
-                    audio_loop = None
-                    audio_thread = None
+            except Exception as e:
+                logger.error(f"Error terminating voice service: {str(e)}")
             
-        return jsonify({"status": "terminated"})
+        return json_response({"status": "terminated"})
 
     @app.route('/status')
     def status():
         """Get the status of the API."""
-        return jsonify({
-            "status": "ok",
-            "vercel": IN_VERCEL,
-            "version": "1.0.0"
-        })
+        return Response(STATUS_RESPONSE_BODY, mimetype='application/json')
     
     return app
 
@@ -1012,4 +1304,5 @@ app = create_app()
 
 # Run the app if executed directly
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=PORT, debug=True)
\ No newline at end of file
+    # Debug mode (debugger and reloader) is opt-in via FLASK_DEBUG=1
+    app.run(host="0.0.0.0", port=PORT)
\ No newline at end of file